@@ -11,14 +11,18 @@
 # - Internet Archive results are filtered to items exposing a license URL. Always verify license before use.
 # - Runs as a long-polling worker on Render Free tier.
 
-import os, html, asyncio
+import os, html, asyncio, time, functools
+from collections import OrderedDict
 from typing import Dict, Optional, List
 
 import aiohttp
+import aiosqlite
+import orjson
 from dotenv import load_dotenv
 
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, LinkPreviewOptions
 from telegram.constants import ParseMode, ChatAction
+from telegram.error import RetryAfter
 from telegram.ext import (
     Application, ApplicationBuilder, CommandHandler,
     CallbackQueryHandler, MessageHandler, filters, ContextTypes
@@ -53,98 +57,215 @@ ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").replace(",", "
 
 APP_BRAND = os.getenv("APP_BRAND", "AllMoviesPro")
 APP_TAGLINE = os.getenv("APP_TAGLINE", "Powered by Empire Movies")
+CHATS_DB = os.getenv("CHATS_DB", "chats.db")
 
 # -------- HTTP helper ---------
 class HTTP:
     def __init__(self):
         self._session: Optional[aiohttp.ClientSession] = None
+    async def open(self):
+        # One long-lived session so TCP+TLS connections to TMDB/IA are kept alive and reused
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=25),
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=75),
+            headers={"User-Agent": "AllMoviesPro/1.0"},
+        )
     async def session(self) -> aiohttp.ClientSession:
-        if not self._session or self._session.closed:
-            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=25))
         return self._session
     async def get_json(self, url: str, params: Dict[str, str] = None, headers: Dict[str, str] = None):
         s = await self.session()
         async with s.get(url, params=params or {}, headers=headers or {}) as r:
             r.raise_for_status()
-            return await r.json()
+            return orjson.loads(await r.read())
     async def close(self):
         if self._session and not self._session.closed:
             await self._session.close()
 http = HTTP()
 
+# -------- Known chats (SQLite) ---------
+class ChatStore:
+    """Persists chat ids across restarts. Inserts are committed in batches by a background task."""
+    def __init__(self, path: str, commit_interval: float = 5.0):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._db: Optional[aiosqlite.Connection] = None
+        self._dirty = False
+        self._flusher: Optional[asyncio.Task] = None
+    async def open(self):
+        self._db = await aiosqlite.connect(self.path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("CREATE TABLE IF NOT EXISTS chats(id INTEGER PRIMARY KEY)")
+        await self._db.commit()
+        self._flusher = asyncio.create_task(self._flush_loop())
+    async def add(self, chat_id: int):
+        await self._db.execute("INSERT OR IGNORE INTO chats VALUES (?)", (chat_id,))
+        self._dirty = True
+    async def all_ids(self) -> List[int]:
+        async with self._db.execute("SELECT id FROM chats") as cur:
+            return [row[0] for row in await cur.fetchall()]
+    async def count(self) -> int:
+        async with self._db.execute("SELECT COUNT(*) FROM chats") as cur:
+            row = await cur.fetchone()
+            return row[0]
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.commit_interval)
+            if self._dirty:
+                self._dirty = False
+                await self._db.commit()
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._db:
+            await self._db.commit()
+            await self._db.close()
+            self._db = None
+chat_store = ChatStore(CHATS_DB)
+
+# -------- TTL cache ---------
+def async_ttl_cache(ttl: float, maxsize: int = 2048):
+    """Cache an async function's result per args for `ttl` seconds.
+    Concurrent misses on the same key await one shared in-flight call, so only one hits
+    the network and its result or exception reaches every waiter. Failures aren't cached."""
+    def deco(fn):
+        cache: Dict[tuple, tuple] = {}
+        inflight: Dict[tuple, asyncio.Future] = {}
+        def settle(key, fut: asyncio.Future):
+            if inflight.get(key) is fut:
+                inflight.pop(key)
+            if fut.cancelled() or fut.exception() is not None:
+                return
+            if len(cache) >= maxsize:
+                now = time.monotonic()
+                for k in [k for k, (exp, _) in cache.items() if exp <= now]:
+                    cache.pop(k, None)
+                if len(cache) >= maxsize:
+                    cache.pop(next(iter(cache)))
+            cache[key] = (time.monotonic() + ttl, fut.result())
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            hit = cache.get(key)
+            if hit and hit[0] > time.monotonic():
+                return hit[1]
+            fut = inflight.get(key)
+            if fut is None:
+                fut = asyncio.ensure_future(fn(*args, **kwargs))
+                inflight[key] = fut
+                fut.add_done_callback(functools.partial(settle, key))
+            # shield: one waiter being cancelled mustn't cancel the call the others share
+            return await asyncio.shield(fut)
+        wrapper.cache_clear = lambda: (cache.clear(), inflight.clear())
+        return wrapper
+    return deco
+
+HOUR = 3600
+
 # -------- TMDB helpers ---------
+# TMDB allows roughly 40 req/s per key; cap in-flight calls so bursts don't trip 429s
+_tmdb_sem = asyncio.Semaphore(30)
+
+async def tmdb_get(path: str, params: Dict[str, str]):
+    async with _tmdb_sem:
+        return await http.get_json(f"{TMDB_BASE}{path}", params)
+
+_MEDIA_TYPES = {"movie": "movie", "tv": "tv"}
+
+def _pack_item(item: Dict, media_type: str) -> Dict:
+    # Shared shape for search/similar/trending rows. Movies carry title/release_date and
+    # TV name/first_air_date, so missing keys are normal and plain itemgetter would raise.
+    get = item.get
+    return {
+        "id": get("id"),
+        "media_type": media_type,
+        "title": get("title") or get("name"),
+        "year": (get("release_date") or get("first_air_date") or "")[:4],
+        "poster": get("poster_path"),
+    }
+
 async def tmdb_search(query: str) -> List[Dict]:
     params = {"api_key": TMDB_API_KEY, "query": query, "include_adult": "false", "language": "en-US", "page": 1}
-    data = await http.get_json(f"{TMDB_BASE}/search/multi", params)
+    data = await tmdb_get("/search/multi", params)
     results = []
     for item in data.get("results", [])[:10]:
-        media_type = item.get("media_type")
-        if media_type not in ("movie", "tv"):
-            continue
-        title = item.get("title") or item.get("name")
-        results.append({
-            "id": item.get("id"),
-            "media_type": media_type,
-            "title": title,
-            "year": (item.get("release_date") or item.get("first_air_date") or "")[:4],
-            "poster": item.get("poster_path"),
-        })
+        media_type = _MEDIA_TYPES.get(item.get("media_type"))
+        if media_type:
+            results.append(_pack_item(item, media_type))
     return results
 
-async def tmdb_details(media_type: str, tmdb_id: int) -> Dict:
-    params = {"api_key": TMDB_API_KEY, "language": "en-US"}
-    return await http.get_json(f"{TMDB_BASE}/{media_type}/{tmdb_id}", params)
+@async_ttl_cache(ttl=6 * HOUR)
+async def tmdb_full(media_type: str, tmdb_id: int) -> Dict:
+    # details + videos + similar + watch/providers in a single round trip. Only the packed
+    # record is cached: the raw response carries every region's providers and all videos.
+    params = {"api_key": TMDB_API_KEY, "language": "en-US", "append_to_response": "videos,similar,watch/providers"}
+    data = await tmdb_get(f"/{media_type}/{tmdb_id}", params)
+    return {
+        "title": data.get("title") or data.get("name"),
+        "year": (data.get("release_date") or data.get("first_air_date") or "")[:4],
+        "overview": data.get("overview"),
+        "poster": data.get("poster_path"),
+        "providers": _providers_from(data.get("watch/providers", {}), WATCH_REGION),
+        "trailer": _trailer_from(data.get("videos", {})),
+        "similar": _similar_from(data.get("similar", {}), media_type),
+    }
 
-async def tmdb_providers(media_type: str, tmdb_id: int, region: str = "IN") -> Dict:
-    params = {"api_key": TMDB_API_KEY}
-    data = await http.get_json(f"{TMDB_BASE}/{media_type}/{tmdb_id}/watch/providers", params)
+def _providers_from(data: Dict, region: str) -> Dict:
     return data.get("results", {}).get(region, {})
 
-async def tmdb_videos(media_type: str, tmdb_id: int) -> Optional[str]:
-    params = {"api_key": TMDB_API_KEY}
-    data = await http.get_json(f"{TMDB_BASE}/{media_type}/{tmdb_id}/videos", params)
+def _trailer_from(data: Dict) -> Optional[str]:
     for v in data.get("results", []):
         if v.get("site") == "YouTube" and v.get("type") in ("Trailer", "Teaser"):
             key = v.get("key")
             return f"https://www.youtube.com/watch?v={key}"
     return None
 
+def _similar_from(data: Dict, media_type: str) -> List[Dict]:
+    return [_pack_item(item, media_type) for item in data.get("results", [])[:10]]
+
+# Per-button lookups for the detail page; served from tmdb_full's cached record
+async def tmdb_providers(media_type: str, tmdb_id: int, region: str = "IN") -> Dict:
+    if region != WATCH_REGION:
+        # tmdb_full only keeps WATCH_REGION; other regions go to the endpoint directly
+        data = await tmdb_get(f"/{media_type}/{tmdb_id}/watch/providers", {"api_key": TMDB_API_KEY})
+        return _providers_from(data, region)
+    return (await tmdb_full(media_type, tmdb_id))["providers"]
+
+async def tmdb_videos(media_type: str, tmdb_id: int) -> Optional[str]:
+    return (await tmdb_full(media_type, tmdb_id))["trailer"]
+
 async def tmdb_similar(media_type: str, tmdb_id: int) -> List[Dict]:
-    params = {"api_key": TMDB_API_KEY, "language": "en-US", "page": 1}
-    data = await http.get_json(f"{TMDB_BASE}/{media_type}/{tmdb_id}/similar", params)
-    out = []
-    for item in data.get("results", [])[:10]:
-        title = item.get("title") or item.get("name")
-        out.append({
-            "id": item.get("id"),
-            "media_type": media_type,
-            "title": title,
-            "year": (item.get("release_date") or item.get("first_air_date") or "")[:4],
-            "poster": item.get("poster_path"),
-        })
-    return out
+    return (await tmdb_full(media_type, tmdb_id))["similar"]
 
+@async_ttl_cache(ttl=HOUR)
 async def tmdb_trending() -> Dict[str, List[Dict]]:
     params = {"api_key": TMDB_API_KEY}
-    movies = await http.get_json(f"{TMDB_BASE}/trending/movie/day", params)
-    tv = await http.get_json(f"{TMDB_BASE}/trending/tv/day", params)
+    # Fetch both lists concurrently; return_exceptions so one failure doesn't orphan the other
+    movies, tv = await asyncio.gather(
+        tmdb_get("/trending/movie/day", params),
+        tmdb_get("/trending/tv/day", params),
+        return_exceptions=True,
+    )
+    for res in (movies, tv):
+        if isinstance(res, BaseException):
+            raise res
     def pack(items):
-        out = []
-        for it in items.get("results", [])[:10]:
-            out.append({
-                "id": it.get("id"),
-                "media_type": "movie" if it.get("title") else "tv",
-                "title": it.get("title") or it.get("name"),
-                "year": (it.get("release_date") or it.get("first_air_date") or "")[:4],
-                "poster": it.get("poster_path"),
-            })
-        return out
+        return [_pack_item(it, "movie" if it.get("title") else "tv") for it in items.get("results", [])[:10]]
     return {"movies": pack(movies), "tv": pack(tv)}
 
 # -------- Internet Archive (public-domain / CC-licensed) ---------
 IA_SEARCH = "https://archive.org/advancedsearch.php"
 IA_META = "https://archive.org/metadata/{identifier}"
-VIDEO_EXTS = {"mp4", "m4v", "webm", "ogv"}
+VIDEO_SUFFIXES = (".mp4", ".m4v", ".webm", ".ogv")
+IA_CONCURRENCY = 5
+
+def _ia_video_links(ident: str, files: List[Dict]) -> List[str]:
+    # A name ending in a video suffix can't also end in ".thumbs", so one endswith covers both checks
+    return [
+        f"https://archive.org/download/{ident}/{name}"
+        for name in (f.get("name", "") for f in files)
+        if name.lower().endswith(VIDEO_SUFFIXES)
+    ]
 
 async def ia_search_public_domain(title: str, limit: int = 5) -> List[Dict]:
     q = f'title:("{title}") AND mediatype:(movies OR video) AND licenseurl:*'
@@ -154,17 +275,22 @@ async def ia_search_public_domain(title: str, limit: int = 5) -> List[Dict]:
     }
     data = await http.get_json(IA_SEARCH, params=params)
     docs = data.get("response", {}).get("docs", [])
+    # File lists aren't a search-index field, so each item still needs /metadata;
+    # fetch them concurrently, bounded for IA politeness
+    sem = asyncio.Semaphore(IA_CONCURRENCY)
+    async def fetch_meta(ident):
+        async with sem:
+            return await http.get_json(IA_META.format(identifier=ident))
+    metas = await asyncio.gather(*(fetch_meta(d.get("identifier")) for d in docs), return_exceptions=True)
     results = []
-    for d in docs:
+    for d, meta in zip(docs, metas):
+        if isinstance(meta, BaseException):
+            continue
+        files = meta.get("files")
+        if not files:
+            continue
         ident = d.get("identifier")
-        meta = await http.get_json(IA_META.format(identifier=ident))
-        files = meta.get("files", [])
-        file_links = []
-        for f in files:
-            name = f.get("name", "")
-            ext = name.split(".")[-1].lower()
-            if ext in VIDEO_EXTS and not name.endswith(".thumbs"):
-                file_links.append(f"https://archive.org/download/{ident}/{name}")
+        file_links = _ia_video_links(ident, files)
         if file_links:
             results.append({
                 "identifier": ident, "title": d.get("title"), "year": d.get("year"),
@@ -173,6 +299,9 @@ async def ia_search_public_domain(title: str, limit: int = 5) -> List[Dict]:
     return results
 
 # -------- Telegram Bot Handlers ---------
+# Titles/provider names repeat a lot across users; free-text like overviews still uses html.escape
+_esc = functools.lru_cache(maxsize=4096)(html.escape)
+
 SPLASH = (
     "<b>{brand}</b>\n"
     "<i>{tag}</i>\n\n"
@@ -185,11 +314,14 @@ SPLASH = (
     "Use: /search <movie ya series ka naam>\n"
     "Try: /trending"
 )
+# Inputs are env constants, so render once at import
+SPLASH_RENDERED = SPLASH.format(brand=html.escape(APP_BRAND), tag=html.escape(APP_TAGLINE), region=WATCH_REGION)
+TRENDING_HEAD = "<b>Trending Now</b>\n\n<b>Movies:</b>\n"
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_chat_action(ChatAction.TYPING)
     await update.message.reply_text(
-        SPLASH.format(brand=html.escape(APP_BRAND), tag=html.escape(APP_TAGLINE), region=WATCH_REGION),
+        SPLASH_RENDERED,
         parse_mode=ParseMode.HTML, disable_web_page_preview=True,
     )
 
@@ -217,41 +349,54 @@ async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         keyboard.append([InlineKeyboardButton(title[:60], callback_data=cbdata)])
     await update.message.reply_text("Select one:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-async def on_pick(update: Update, context: ContextTypes.DEFAULT_TYPE):
+@functools.lru_cache(maxsize=1024)
+def _build_detail_kb(media_type: str, tmdb_id: int, title_safe: str) -> InlineKeyboardMarkup:
+    # Same keyboard for every user picking this title; PTB markups are immutable, so sharing is safe
+    buttons = [
+        [InlineKeyboardButton("Where to Watch (IN)", callback_data=f"prov|{media_type}|{tmdb_id}")],
+        [InlineKeyboardButton("Trailer", callback_data=f"trailer|{media_type}|{tmdb_id}")],
+        [InlineKeyboardButton("Public-Domain Downloads", callback_data=f"pd|{media_type}|{tmdb_id}|{title_safe}")],
+        [InlineKeyboardButton("Recommendations", callback_data=f"rec|{media_type}|{tmdb_id}")],
+    ]
+    return InlineKeyboardMarkup(buttons)
+
+async def on_pick(update: Update, context: ContextTypes.DEFAULT_TYPE, parts: List[str]):
     q = update.callback_query; await q.answer()
     try:
-        _, media_type, id_str = q.data.split("|"); tmdb_id = int(id_str)
+        _, media_type, id_str = parts; tmdb_id = int(id_str)
     except Exception:
         await q.edit_message_text("Invalid selection."); return
     try:
-        details = await tmdb_details(media_type, tmdb_id)
+        details = await tmdb_full(media_type, tmdb_id)
     except Exception as e:
         await q.edit_message_text(f"TMDB error: {e}"); return
+    # Providers, trailer and similar came back in the same cached record, so the
+    # detail buttons below are TTL-cache hits rather than new TMDB requests
 
-    title = details.get("title") or details.get("name")
-    year = (details.get("release_date") or details.get("first_air_date") or "")[:4]
-    overview = details.get("overview") or "No overview available."
-    poster = details.get("poster_path")
+    title = details["title"]
+    year = details["year"]
+    overview = details["overview"] or "No overview available."
+    poster = details["poster"]
 
-    text = f"<b>{html.escape(title)}</b> ({html.escape(year)})\n\n{html.escape(overview)}"
+    text = f"<b>{_esc(title)}</b> ({_esc(year)})\n\n{html.escape(overview)}"
 
-    buttons = [
-        [InlineKeyboardButton("Where to Watch (IN)", callback_data=f"prov|{media_type}|{tmdb_id}")],
-        [InlineKeyboardButton("Trailer", callback_data=f"trailer|{media_type}|{tmdb_id}")],
-        [InlineKeyboardButton("Public-Domain Downloads", callback_data=f"pd|{media_type}|{tmdb_id}|{title.replace('|',' ')}")],
-        [InlineKeyboardButton("Recommendations", callback_data=f"rec|{media_type}|{tmdb_id}")],
-    ]
+    markup = _build_detail_kb(media_type, tmdb_id, title.replace('|', ' '))
 
     if poster:
         photo_url = f"{TMDB_IMG}{poster}"
         try:
-            await q.message.reply_photo(photo=photo_url, caption=text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(buttons))
+            # Poster via link preview: one small text message instead of Telegram fetching a photo upload
+            await q.message.reply_text(
+                text=text, parse_mode=ParseMode.HTML, reply_markup=markup,
+                link_preview_options=LinkPreviewOptions(url=photo_url, show_above_text=True, prefer_large_media=True),
+            )
         except Exception:
-            await q.edit_message_text(text=text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(buttons))
+            await q.edit_message_text(text=text, parse_mode=ParseMode.HTML, reply_markup=markup)
     else:
-        await q.edit_message_text(text=text, parse_mode=ParseMode.HTML, reply_markup=InlineKeyboardMarkup(buttons))
+        await q.edit_message_text(text=text, parse_mode=ParseMode.HTML, reply_markup=markup)
 
-async def on_providers(update: Update, context: ContextTypes.DEFAULT_TYPE, media_type: str, tmdb_id: int):
+async def on_providers(update: Update, context: ContextTypes.DEFAULT_TYPE, parts: List[str]):
+    _, media_type, id_str = parts; tmdb_id = int(id_str)
     try:
         prov = await tmdb_providers(media_type, tmdb_id, region=WATCH_REGION)
     except Exception as e:
@@ -261,21 +406,23 @@ async def on_providers(update: Update, context: ContextTypes.DEFAULT_TYPE, media
     def fmt(kind):
         items = prov.get(kind) or []
         names = [p.get("provider_name") for p in items if p.get("provider_name")]
-        return ", ".join(sorted(set(names))) if names else "—"
-    lines.append(f"Streaming: {html.escape(fmt('flatrate'))}")
-    lines.append(f"Rent: {html.escape(fmt('rent'))}")
-    lines.append(f"Buy: {html.escape(fmt('buy'))}")
+        return ", ".join(_esc(n) for n in sorted(set(names))) if names else "—"
+    lines.append(f"Streaming: {fmt('flatrate')}")
+    lines.append(f"Rent: {fmt('rent')}")
+    lines.append(f"Buy: {fmt('buy')}")
     lines.append("\nNote: Availability can change. Check in your apps.")
     await update.callback_query.edit_message_text("\n".join(lines), parse_mode=ParseMode.HTML)
 
-async def on_trailer(update: Update, context: ContextTypes.DEFAULT_TYPE, media_type: str, tmdb_id: int):
+async def on_trailer(update: Update, context: ContextTypes.DEFAULT_TYPE, parts: List[str]):
+    _, media_type, id_str = parts; tmdb_id = int(id_str)
     url = await tmdb_videos(media_type, tmdb_id)
     if url:
         await update.callback_query.edit_message_text(f"Trailer: {url}")
     else:
         await update.callback_query.edit_message_text("Trailer not found.")
 
-async def on_public_domain(update: Update, context: ContextTypes.DEFAULT_TYPE, title: str):
+async def on_public_domain(update: Update, context: ContextTypes.DEFAULT_TYPE, parts: List[str]):
+    title = parts[3] if len(parts) > 3 else ""
     await update.callback_query.edit_message_text("Searching Internet Archive (public-domain/CC) …")
     try:
         items = await ia_search_public_domain(title)
@@ -292,7 +439,8 @@ async def on_public_domain(update: Update, context: ContextTypes.DEFAULT_TYPE, t
     msg = "\n\n".join(chunks) + "\n\nOnly share/use content permitted by the license."
     await update.callback_query.edit_message_text(msg, disable_web_page_preview=True, parse_mode=ParseMode.HTML)
 
-async def on_recommend(update: Update, context: ContextTypes.DEFAULT_TYPE, media_type: str, tmdb_id: int):
+async def on_recommend(update: Update, context: ContextTypes.DEFAULT_TYPE, parts: List[str]):
+    _, media_type, id_str = parts; tmdb_id = int(id_str)
     try:
         sims = await tmdb_similar(media_type, tmdb_id)
     except Exception as e:
@@ -302,7 +450,7 @@ async def on_recommend(update: Update, context: ContextTypes.DEFAULT_TYPE, media
     lines = ["<b>Similar titles:</b>"]
     for s in sims[:10]:
         t = f"{s['title']} ({s.get('year','')})" if s.get("year") else s["title"]
-        lines.append(f"• {html.escape(t)}")
+        lines.append(f"• {_esc(t)}")
     await update.callback_query.edit_message_text("\n".join(lines), parse_mode=ParseMode.HTML)
 
 async def cmd_trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -311,12 +459,17 @@ async def cmd_trending(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_chat_action(ChatAction.TYPING)
     data = await tmdb_trending()
     def fmt(lst: List[Dict]) -> str:
-        items = [f"• {html.escape((i['title']))} ({html.escape(i.get('year',''))})" for i in lst[:10]]
+        items = [f"• {_esc(i['title'])} ({_esc(i.get('year',''))})" for i in lst[:10]]
         return "\n".join(items) if items else "—"
-    msg = "<b>Trending Now</b>\n\n<b>Movies:</b>\n" + fmt(data["movies"]) + "\n\n<b>TV:</b>\n" + fmt(data["tv"])
+    msg = TRENDING_HEAD + fmt(data["movies"]) + "\n\n<b>TV:</b>\n" + fmt(data["tv"])
     await update.message.reply_text(msg, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
 
 # --- Admin tools ---
+BROADCAST_CONCURRENCY = 25
+BROADCAST_RATE = 30  # Telegram global flood limit, msg/s
+BROADCAST_RETRIES = 3
+MAX_RECENT_CHATS = 50000
+
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_USER_IDS
 
@@ -327,57 +480,97 @@ async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = " ".join(context.args).strip()
     if not msg:
         await update.message.reply_text("Usage: /broadcast <message>"); return
-    chats = context.bot_data.get("recent_chats", set())
+    chats = await chat_store.all_ids()
+    sem = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    # Telegram's flood wait is global, so a RetryAfter seen by one send pauses them all
+    flood_until = 0.0
+    async def _send(chat_id) -> int:
+        nonlocal flood_until
+        async with sem:
+            for attempt in range(BROADCAST_RETRIES):
+                # Loop because another send may push flood_until further out while we sleep
+                while (wait := flood_until - time.monotonic()) > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    await context.bot.send_message(chat_id=chat_id, text=msg)
+                    return 1
+                except RetryAfter as e:
+                    # Wait what Telegram asks, plus exponential backoff on repeats
+                    flood_until = max(flood_until, time.monotonic() + e.retry_after + (2 ** attempt - 1))
+                    if attempt == BROADCAST_RETRIES - 1:
+                        return 0
+                except Exception:
+                    return 0
+                finally:
+                    # Failed sends count against the flood limit too, so every attempt holds the
+                    # slot a little to keep total throughput under BROADCAST_RATE msg/s
+                    await asyncio.sleep(BROADCAST_CONCURRENCY / BROADCAST_RATE)
+            return 0
     sent = 0
-    for chat_id in list(chats):
-        try:
-            await context.bot.send_message(chat_id=chat_id, text=msg)
-            sent += 1
-        except Exception:
-            pass
+    for fut in asyncio.as_completed([_send(c) for c in chats]):
+        sent += await fut
     await update.message.reply_text(f"Broadcast sent to ~{sent} chats.")
 
 async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chats = context.bot_data.get("recent_chats", set())
-    await update.message.reply_text(f"Known chats: {len(chats)} | Admins: {len(ADMIN_USER_IDS)}")
+    known = await chat_store.count()
+    await update.message.reply_text(f"Known chats: {known} | Admins: {len(ADMIN_USER_IDS)}")
 
 async def on_text_fallback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    chats = context.bot_data.setdefault("recent_chats", set())
-    if update.effective_chat: chats.add(update.effective_chat.id)
+    # In-memory LRU of recently seen chats; only chats missing from it are written to the store
+    chats = context.bot_data.setdefault("recent_chats", OrderedDict())
+    if update.effective_chat:
+        cid = update.effective_chat.id
+        if cid not in chats:
+            await chat_store.add(cid)
+        chats[cid] = None
+        chats.move_to_end(cid)
+        if len(chats) > MAX_RECENT_CHATS:
+            chats.popitem(last=False)
     q = (update.message.text or "").strip()
     if not q: return
     update.message.text = f"/search {q}"
     await search_cmd(update, context)
 
+# callback_data tag -> handler(update, context, parts)
+DISPATCH = {
+    "pick": on_pick,
+    "prov": on_providers,
+    "trailer": on_trailer,
+    "pd": on_public_domain,
+    "rec": on_recommend,
+}
+
 async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q or not q.data: return
     try:
-        parts = q.data.split("|")
-        tag = parts[0]
-        if tag == "pick":
-            await on_pick(update, context)
-        elif tag == "prov":
-            _, media_type, id_str = parts
-            await on_providers(update, context, media_type, int(id_str))
-        elif tag == "trailer":
-            _, media_type, id_str = parts
-            await on_trailer(update, context, media_type, int(id_str))
-        elif tag == "pd":
-            title = "|".join(parts[3:])
-            await on_public_domain(update, context, title)
-        elif tag == "rec":
-            _, media_type, id_str = parts
-            await on_recommend(update, context, media_type, int(id_str))
+        # "pd|<type>|<id>|<title>" is the widest payload, so the title stays one part
+        parts = q.data.split("|", 3)
+        fn = DISPATCH.get(parts[0])
+        if fn:
+            await fn(update, context, parts)
         else:
             await q.answer()
     except Exception as e:
         await q.edit_message_text(f"Error: {e}")
 
-async def main():
+class ConfigError(RuntimeError):
+    pass
+
+async def main() -> Application:
+    """Build and start the bot (polling in the background) and return the running Application.
+    The caller owns the event loop and must call shutdown() when done."""
     if not BOT_TOKEN or not TMDB_API_KEY:
-        raise SystemExit("Please set BOT_TOKEN and TMDB_API_KEY environment variables. See README.md")
-    app: Application = ApplicationBuilder().token(BOT_TOKEN).build()
+        # Not SystemExit: asyncio re-raises that out of the loop when main() runs as a task
+        raise ConfigError("Please set BOT_TOKEN and TMDB_API_KEY environment variables. See README.md")
+    # Larger pools so bursts of callbacks/broadcast sends don't queue for a free connection
+    app: Application = (
+        ApplicationBuilder().token(BOT_TOKEN)
+        .connection_pool_size(256).pool_timeout(30)
+        .get_updates_connection_pool_size(16).get_updates_pool_timeout(30)
+        .connect_timeout(10).read_timeout(30)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
     app.add_handler(CommandHandler("search", search_cmd))
@@ -386,19 +579,41 @@ async def main():
     app.add_handler(CommandHandler("stats", cmd_stats))
     app.add_handler(CallbackQueryHandler(callback_router))
     app.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), on_text_fallback))
+    await http.open()
     try:
+        await chat_store.open()
         await app.initialize()
         await app.start()
-        print("Bot is running. Press Ctrl+C to stop.")
         await app.updater.start_polling()
-        await asyncio.Event().wait()
-    finally:
+    except BaseException:
+        # Bad token / network error mid-startup: don't leak the session, DB or flusher task
+        await shutdown(app)
+        raise
+    print("Bot is running. Press Ctrl+C to stop.")
+    return app
+
+async def shutdown(app: Application):
+    # Tolerates a partially started app, so main() can use it to unwind a failed startup
+    if app.updater and app.updater.running:
         await app.updater.stop()
+    if app.running:
         await app.stop()
-        await http.close()
+    await app.shutdown()
+    await http.close()
+    await chat_store.close()
+
+async def run_forever():
+    # Standalone worker mode (python bot.py)
+    app = await main()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await shutdown(app)
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(run_forever())
+    except ConfigError as e:
+        raise SystemExit(str(e))
     except (KeyboardInterrupt, SystemExit):
         pass
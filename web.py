@@ -1,26 +1,55 @@
 import os
-import threading
 import asyncio
-from flask import Flask
+import logging
+from hypercorn.asyncio import serve as hypercorn_serve
+from hypercorn.config import Config
+from quart import Quart
 import bot  # yaha apna bot.py import hoga
 
-app = Flask(__name__)
+log = logging.getLogger(__name__)
+
+app = Quart(__name__)
+# Set when the bot task dies, so `python web.py` shuts the server down too
+bot_failed = asyncio.Event()
 
 @app.route("/")
-def home():
+async def home():
+    # main() returns once polling has started; a stored exception means startup failed,
+    # so report 503 and let the host's health check restart us
+    task = getattr(app, "bot_task", None)
+    if task is not None and task.done() and (task.cancelled() or task.exception() is not None):
+        return "❌ Telegram Bot failed to start", 503
     return "✅ Telegram Bot is running on Render!"
 
-def run_bot():
-    try:
-        asyncio.run(bot.main())  # bot.py ka main() run hoga
-    except (KeyboardInterrupt, SystemExit):
-        pass
+def _on_bot_done(task: asyncio.Task):
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        log.error("Bot startup failed", exc_info=exc)
+        bot_failed.set()
 
-if __name__ == "__main__":
-    # Bot ko background thread me chalao
-    threading.Thread(target=run_bot).start()
+@app.before_serving
+async def start_bot():
+    # Bot polling isi event loop me background task banke chalega
+    app.bot_task = asyncio.create_task(bot.main())
+    app.bot_task.add_done_callback(_on_bot_done)
+
+@app.after_serving
+async def stop_bot():
+    task = app.bot_task
+    if task.done() and not task.cancelled() and task.exception() is None:
+        await bot.shutdown(task.result())
+    else:
+        task.cancel()
 
-    # Flask web server start karo
+async def serve(port: int):
+    config = Config()
+    config.bind = [f"0.0.0.0:{port}"]
+    await hypercorn_serve(app, config, shutdown_trigger=bot_failed.wait)
+
+if __name__ == "__main__":
+    # Same as: hypercorn web:app --bind 0.0.0.0:$PORT
+    logging.basicConfig(level=logging.INFO)
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
-  
+    asyncio.run(serve(port))